@@ -1,66 +1,209 @@
+import logging
 import os
-from datetime import datetime
-from typing import Any, Dict, Optional, List
-from pymongo import MongoClient
-from pymongo.collection import Collection
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, Optional, List
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from pymongo import IndexModel, ReturnDocument
+from pymongo.errors import OperationFailure
 
 DATABASE_URL = os.getenv("DATABASE_URL", "mongodb://localhost:27017")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "appdb")
 
-_client: Optional[MongoClient] = None
-_db = None
+logger = logging.getLogger(__name__)
+
+# (date, _id) covers date range scans and gives the list endpoints a stable index-backed sort;
+# (category, date) serves per-category recaps and created_at serves "latest N" queries
+INDEXES: Dict[str, List[IndexModel]] = {
+    "activity": [
+        IndexModel([("date", 1), ("_id", 1)]),
+        IndexModel([("category", 1), ("date", 1)]),
+        IndexModel([("created_at", -1)]),
+    ],
+    "finance": [
+        IndexModel([("date", 1), ("_id", 1)]),
+        IndexModel([("category", 1)]),
+        IndexModel([("created_at", -1)]),
+    ],
+}
+
+_client = AsyncIOMotorClient(
+    DATABASE_URL,
+    maxPoolSize=20,
+    minPoolSize=5,
+    maxIdleTimeMS=60000,
+    serverSelectionTimeoutMS=5000,
+    appname="monthly-report",
+    # Timestamps are written timezone-aware; read them back the same way
+    tz_aware=True,
+)
+_db = _client[DATABASE_NAME]
+collections: Dict[str, AsyncIOMotorCollection] = {name: _db[name] for name in ("activity", "finance", "file")}
+
 
 def get_db():
-    global _client, _db
-    if _db is None:
-        _client = MongoClient(DATABASE_URL)
-        _db = _client[DATABASE_NAME]
     return _db
 
 
-def collection(name: str) -> Collection:
-    return get_db()[name]
+def collection(name: str) -> AsyncIOMotorCollection:
+    return collections[name]
+
+
+async def init_db() -> None:
+    # Pay the connection handshake once at startup rather than on the first request
+    await _client.admin.command("ping")
+    for name in ("activity", "finance"):
+        # Older writes may have stored dates as ISO strings; convert them once so the range
+        # filter matches them. Strings that don't parse are left as they are rather than
+        # failing startup; date_range() keeps them out of every list and recap query.
+        await collections[name].update_many(
+            {"date": {"$type": "string"}},
+            [{"$set": {"date": {"$convert": {"input": "$date", "to": "date", "onError": "$date", "onNull": "$date"}}}}],
+        )
+        unconverted = await collections[name].count_documents({"date": {"$not": {"$type": "date"}}})
+        if unconverted:
+            logger.warning("%d %s documents have a date that is not a BSON Date and will not be listed", unconverted, name)
+        try:
+            await collections[name].create_indexes(INDEXES[name])
+        except OperationFailure as e:
+            # An index with the same key but different options already exists; keep serving with it
+            logger.warning("Could not create indexes on %s: %s", name, e)
+
+
+def _to_bson_date(data: Dict[str, Any]) -> Dict[str, Any]:
+    # BSON has no plain date type; store as a Date so range queries can use the index
+    v = data.get("date")
+    if isinstance(v, date) and not isinstance(v, datetime):
+        data["date"] = datetime.combine(v, datetime.min.time())
+    return data
+
+
+def date_range(month: Optional[int] = None, year: Optional[int] = None) -> Dict[str, Any]:
+    # Every branch matches only BSON Dates (range operators bracket by type), so legacy
+    # values init_db() couldn't convert never reach the cursor encoder or $month
+    if year and month:
+        start = datetime(year, month, 1)
+        end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+        return {"date": {"$gte": start, "$lt": end}}
+    if year:
+        return {"date": {"$gte": datetime(year, 1, 1), "$lt": datetime(year + 1, 1, 1)}}
+    if month:
+        # $and short-circuits, so $month only ever sees a Date
+        return {"date": {"$type": "date"}, "$expr": {"$and": [
+            {"$eq": [{"$type": "$date"}, "date"]},
+            {"$eq": [{"$month": "$date"}, month]},
+        ]}}
+    return {"date": {"$type": "date"}}
+
+
+async def create_document(collection_name: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    col = collection(collection_name)
+    _to_bson_date(data)
+    now = datetime.now(timezone.utc)
+    data.update({"created_at": now, "updated_at": now})
+    res = await col.insert_one(data)
+    data["_id"] = res.inserted_id
+    return serialize_document(data)
 
 
-def create_document(collection_name: str, data: Dict[str, Any]) -> Dict[str, Any]:
+async def create_documents(collection_name: str, data_list: List[Dict[str, Any]]) -> List[str]:
+    if not data_list:
+        return []
     col = collection(collection_name)
-    now = datetime.utcnow()
-    data.update({"created_at": now, "updated_at": now})
-    res = col.insert_one(data)
-    doc = col.find_one({"_id": res.inserted_id})
-    return serialize_document(doc)
+    now = datetime.now(timezone.utc)
+    for data in data_list:
+        _to_bson_date(data)
+        data.update({"created_at": now, "updated_at": now})
+    res = await col.insert_many(data_list, ordered=False)
+    return [str(_id) for _id in res.inserted_ids]
 
 
-def update_document(collection_name: str, doc_id, updates: Dict[str, Any]) -> Dict[str, Any]:
-    from bson import ObjectId
+async def update_document(collection_name: str, doc_id, updates: Dict[str, Any]) -> Dict[str, Any]:
     col = collection(collection_name)
-    updates.update({"updated_at": datetime.utcnow()})
-    col.update_one({"_id": ObjectId(doc_id)}, {"$set": updates})
-    doc = col.find_one({"_id": ObjectId(doc_id)})
+    _to_bson_date(updates)
+    updates.update({"updated_at": datetime.now(timezone.utc)})
+    doc = await col.find_one_and_update(
+        {"_id": ObjectId(doc_id)}, {"$set": updates}, return_document=ReturnDocument.AFTER
+    )
     return serialize_document(doc)
 
 
-def delete_document(collection_name: str, doc_id) -> bool:
-    from bson import ObjectId
+async def delete_document(collection_name: str, doc_id) -> bool:
     col = collection(collection_name)
-    res = col.delete_one({"_id": ObjectId(doc_id)})
+    res = await col.delete_one({"_id": ObjectId(doc_id)})
     return res.deleted_count == 1
 
 
-def get_documents(collection_name: str, filter_dict: Dict[str, Any] = None, limit: int = 1000, sort: Optional[List] = None) -> List[Dict[str, Any]]:
-    col = collection(collection_name)
-    cursor = col.find(filter_dict or {})
+def _find(collection_name: str, filter_dict: Dict[str, Any] = None, sort: Optional[List] = None, limit: Optional[int] = None):
+    cursor = collection(collection_name).find(filter_dict or {}).batch_size(1000)
     if sort:
         cursor = cursor.sort(sort)
     if limit:
         cursor = cursor.limit(limit)
-    return [serialize_document(d) for d in cursor]
-
-
-def get_document(collection_name: str, doc_id) -> Optional[Dict[str, Any]]:
-    from bson import ObjectId
+    return cursor
+
+
+async def iter_documents(collection_name: str, filter_dict: Dict[str, Any] = None, sort: Optional[List] = None, limit: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+    # Yields one document at a time for callers that shouldn't hold the whole result set
+    async for d in _find(collection_name, filter_dict, sort=sort, limit=limit):
+        yield serialize_document(d)
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MS = timedelta(milliseconds=1)
+
+
+def _encode_cursor(doc: Dict[str, Any]) -> str:
+    # Built from the stored datetime, not the serialized date: legacy dates can carry a time of day.
+    # "<epoch ms>_<hex id>" is URL-safe, so clients can pass it back as ?cursor= without quoting it.
+    d = doc["date"]
+    if d.tzinfo is None:
+        d = d.replace(tzinfo=timezone.utc)
+    return f"{(d - _EPOCH) // _MS}_{doc['_id']}"
+
+
+def _decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        ms, _id = cursor.split("_")
+        last_date, last_id = _EPOCH + int(ms) * _MS, ObjectId(_id)
+    except Exception:
+        raise ValueError("Invalid cursor") from None
+    return {"$or": [{"date": {"$gt": last_date}}, {"date": last_date, "_id": {"$gt": last_id}}]}
+
+
+async def get_documents_page(collection_name: str, filter_dict: Dict[str, Any] = None, page_size: int = 100, cursor: Optional[str] = None) -> Dict[str, Any]:
+    # Keyset pagination on the (date, _id) index: the cursor is the sort key of the last item returned.
+    # One extra document is fetched to tell whether another page follows.
+    filter_dict = filter_dict or {}
+    if cursor:
+        filter_dict = {"$and": [filter_dict, _decode_cursor(cursor)]}
+    docs = await _find(collection_name, filter_dict, sort=[("date", 1), ("_id", 1)], limit=page_size + 1).to_list(length=page_size + 1)
+    next_cursor = _encode_cursor(docs[page_size - 1]) if len(docs) > page_size else None
+    return {"items": [serialize_document(d) for d in docs[:page_size]], "next_cursor": next_cursor}
+
+
+async def recap_aggregate(month: int, year: int) -> Dict[str, Any]:
+    match = {"$match": date_range(month, year)}
+    by_cat_cursor = collection("activity").aggregate(
+        [match, {"$group": {"_id": "$category", "n": {"$sum": 1}}}], allowDiskUse=True, batchSize=1000
+    )
+    totals_cursor = collection("finance").aggregate([
+        match,
+        {"$group": {"_id": None, "income": {"$sum": "$income"}, "expense": {"$sum": "$expense"}}},
+    ], allowDiskUse=True)
+    by_cat = {row["_id"]: row["n"] async for row in by_cat_cursor}
+    totals = await totals_cursor.to_list(length=1)
+    totals = totals[0] if totals else {}
+    return {
+        "activities_by_category": by_cat,
+        "total_income": totals.get("income", 0),
+        "total_expense": totals.get("expense", 0),
+    }
+
+
+async def get_document(collection_name: str, doc_id) -> Optional[Dict[str, Any]]:
     col = collection(collection_name)
-    doc = col.find_one({"_id": ObjectId(doc_id)})
+    doc = await col.find_one({"_id": ObjectId(doc_id)})
     return serialize_document(doc) if doc else None
 
 
@@ -71,4 +214,7 @@ def serialize_document(doc: Dict[str, Any]) -> Dict[str, Any]:
     _id = doc.pop("_id", None)
     if _id is not None:
         doc["id"] = str(_id)
+    # `date` is stored as a midnight datetime (see _to_bson_date); hand it back as the date it was
+    if isinstance(doc.get("date"), datetime):
+        doc["date"] = doc["date"].date()
     return doc
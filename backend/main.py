@@ -1,22 +1,22 @@
-from fastapi import FastAPI, UploadFile, File as FastAPIFile, Form, HTTPException
+from fastapi import FastAPI, Body, Query, Request, UploadFile, File as FastAPIFile, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
-from pydantic import BaseModel
-from datetime import date, datetime
-from typing import List, Optional, Dict, Any
+from fastapi.responses import Response, StreamingResponse, ORJSONResponse, FileResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, conlist
+from bson.errors import InvalidId
+from datetime import date
+from typing import Optional, Dict, Tuple
+from functools import lru_cache
 import io
+import time
+import uuid
 
-from database import create_document, get_documents, update_document, delete_document, get_document
-from schemas import Activity, Finance, File as FileSchema, ActivityOut, FinanceOut, FileOut
+from database import create_document, create_documents, get_documents_page, iter_documents, update_document, delete_document, get_document, date_range, init_db, recap_aggregate
+from schemas import Activity, Finance, File as FileSchema, ActivityOut, FinanceOut, FileOut, ActivityPage, FinancePage
 
 # Simple AI summary placeholder (could be replaced with actual LLM)
-def generate_summary(month: int, year: int, activities: List[Dict[str, Any]], finances: List[Dict[str, Any]]) -> str:
-    total_acts = len(activities)
-    by_cat: Dict[str, int] = {}
-    for a in activities:
-        by_cat[a["category"]] = by_cat.get(a["category"], 0) + 1
-    income = sum(f.get("income", 0) for f in finances)
-    expense = sum(f.get("expense", 0) for f in finances)
+def generate_summary(month: int, year: int, by_cat: Dict[str, int], income: float, expense: float) -> str:
+    total_acts = sum(by_cat.values())
     top_cat = max(by_cat, key=by_cat.get) if by_cat else "-"
     return (
         f"Monthly Summary for {year}-{month:02d}:\n"
@@ -25,7 +25,7 @@ def generate_summary(month: int, year: int, activities: List[Dict[str, Any]], fi
         f"Finance — Income: {income:.2f}, Expense: {expense:.2f}, Net: {income-expense:.2f}."
     )
 
-app = FastAPI(title="Monthly Report API")
+app = FastAPI(title="Monthly Report API", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -35,6 +35,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(InvalidId)
+async def invalid_id_handler(request: Request, exc: InvalidId):
+    # Malformed ids in the path are a client error, not a 500
+    return ORJSONResponse(status_code=400, content={"detail": "Invalid id"})
+
+@app.on_event("startup")
+async def startup():
+    await init_db()
+
 # Health
 @app.get("/test")
 def test():
@@ -44,90 +53,141 @@ def test():
 import os
 UPLOAD_DIR = os.path.join("/tmp", "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 50 * 1024 * 1024))
+
+# FastAPI spools the whole multipart body to a temp file before the handler runs, so the
+# upload limit is applied to the raw ASGI receive stream: a declared Content-Length over
+# the limit is refused up front, and chunked bodies are cut off as soon as they pass it.
+# A plain ASGI class also avoids BaseHTTPMiddleware's overhead on every other route.
+class UploadLimitMiddleware:
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != "/files":
+            await self.app(scope, receive, send)
+            return
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            response = ORJSONResponse(status_code=413, content={"detail": "File too large"})
+            await response(scope, receive, send)
+            return
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised inside body parsing; FastAPI re-raises HTTPExceptions from there as-is
+                    raise HTTPException(status_code=413, detail="File too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES)
 
 @app.post("/files", response_model=FileOut)
 async def upload_file(file: UploadFile = FastAPIFile(...)):
-    contents = await file.read()
-    path = os.path.join(UPLOAD_DIR, f"{int(datetime.utcnow().timestamp()*1000)}_{file.filename}")
+    path = os.path.join(UPLOAD_DIR, f"{time.time_ns()}_{uuid.uuid4().hex}_{file.filename}")
+    size = 0
+    # Copy in chunks so memory stays at UPLOAD_CHUNK_SIZE; disk writes run off the event loop
     with open(path, "wb") as f:
-        f.write(contents)
-    doc = create_document("file", {
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await run_in_threadpool(f.write, chunk)
+            size += len(chunk)
+    doc = await create_document("file", {
         "filename": file.filename,
         "content_type": file.content_type or "application/octet-stream",
         "url": path,
-        "size": len(contents)
+        "size": size
     })
     return doc
 
 @app.get("/files/{file_id}")
 async def get_file(file_id: str):
-    doc = get_document("file", file_id)
+    doc = await get_document("file", file_id)
     if not doc:
         raise HTTPException(status_code=404, detail="File not found")
     path = doc.get("url")
     if not os.path.exists(path):
         raise HTTPException(status_code=404, detail="File missing on disk")
-    def iterfile():
-        with open(path, "rb") as f:
-            yield from f
-    return StreamingResponse(iterfile(), media_type=doc.get("content_type", "application/octet-stream"))
+    return FileResponse(path, media_type=doc.get("content_type", "application/octet-stream"), filename=doc.get("filename"))
+
+# date_range() builds the first day of the following month/year, so the year must leave room for it
+MAX_YEAR = 9998
 
 # Activities CRUD
 @app.post("/activities", response_model=ActivityOut)
 async def create_activity(payload: Activity):
-    doc = create_document("activity", payload.dict())
+    doc = await create_document("activity", payload.dict())
+    _invalidate_recap(payload.date)
     return doc
 
-@app.get("/activities", response_model=List[ActivityOut])
-async def list_activities(month: Optional[int] = None, year: Optional[int] = None):
-    filter_q: Dict[str, Any] = {}
-    docs = get_documents("activity", filter_q, sort=[("date", 1)])
-    # Client-side can filter; for simplicity, do minimal filtering here
-    if month or year:
-        res = []
-        for d in docs:
-            d_date = datetime.fromisoformat(str(d["date"])) if not isinstance(d["date"], datetime) else d["date"]
-            if (not year or d_date.year == year) and (not month or d_date.month == month):
-                res.append(d)
-        return res
-    return docs
+# conlist checks the length before validating any item, so oversized batches are cheap to refuse
+MAX_BULK_ITEMS = 1000
+
+@app.post("/activities/bulk")
+async def create_activities(payload: conlist(Activity, max_items=MAX_BULK_ITEMS) = Body(...)):
+    try:
+        ids = await create_documents("activity", [p.dict() for p in payload])
+    finally:
+        # An unordered insert_many can fail after inserting some of the batch; drop those months either way
+        for d in {p.date for p in payload}:
+            _invalidate_recap(d)
+    return {"inserted_ids": ids}
+
+@app.get("/activities", response_model=None, responses={200: {"model": ActivityPage}})
+async def list_activities(month: Optional[int] = Query(None, ge=1, le=12), year: Optional[int] = Query(None, ge=1, le=MAX_YEAR), cursor: Optional[str] = None, page_size: int = Query(100, ge=1, le=500)):
+    try:
+        page = await get_documents_page("activity", date_range(month, year), page_size=page_size, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Documents from Mongo already have the *Out shape; returning the response directly skips
+    # FastAPI's per-item response_model re-validation, and orjson encodes the dates itself
+    return ORJSONResponse(page)
 
 @app.put("/activities/{id}", response_model=ActivityOut)
 async def update_activity(id: str, payload: Activity):
-    doc = update_document("activity", id, payload.dict())
+    doc = await update_document("activity", id, payload.dict())
+    _invalidate_recap()
     return doc
 
 @app.delete("/activities/{id}")
 async def remove_activity(id: str):
-    ok = delete_document("activity", id)
+    ok = await delete_document("activity", id)
+    _invalidate_recap()
     return {"success": ok}
 
 # Finances CRUD
 @app.post("/finances", response_model=FinanceOut)
 async def create_finance(payload: Finance):
-    doc = create_document("finance", payload.dict())
+    doc = await create_document("finance", payload.dict())
+    _invalidate_recap(payload.date)
     return doc
 
-@app.get("/finances", response_model=List[FinanceOut])
-async def list_finances(month: Optional[int] = None, year: Optional[int] = None):
-    docs = get_documents("finance", sort=[("date", 1)])
-    if month or year:
-        res = []
-        for d in docs:
-            d_date = datetime.fromisoformat(str(d["date"])) if not isinstance(d["date"], datetime) else d["date"]
-            if (not year or d_date.year == year) and (not month or d_date.month == month):
-                res.append(d)
-        return res
-    return docs
+@app.get("/finances", response_model=None, responses={200: {"model": FinancePage}})
+async def list_finances(month: Optional[int] = Query(None, ge=1, le=12), year: Optional[int] = Query(None, ge=1, le=MAX_YEAR), cursor: Optional[str] = None, page_size: int = Query(100, ge=1, le=500)):
+    try:
+        page = await get_documents_page("finance", date_range(month, year), page_size=page_size, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ORJSONResponse(page)
 
 @app.put("/finances/{id}", response_model=FinanceOut)
 async def update_finance(id: str, payload: Finance):
-    doc = update_document("finance", id, payload.dict())
+    doc = await update_document("finance", id, payload.dict())
+    _invalidate_recap()
     return doc
 
 @app.delete("/finances/{id}")
 async def remove_finance(id: str):
-    ok = delete_document("finance", id)
+    ok = await delete_document("finance", id)
+    _invalidate_recap()
     return {"success": ok}
 
 # Aggregate endpoints
@@ -141,20 +201,46 @@ class RecapResponse(BaseModel):
     net: float
     summary: str
 
-@app.get("/recap", response_model=RecapResponse)
-async def monthly_recap(month: int, year: int):
-    acts = await list_activities(month=month, year=year)
-    fins = await list_finances(month=month, year=year)
-    by_cat: Dict[str, int] = {}
-    for a in acts:
-        by_cat[a["category"]] = by_cat.get(a["category"], 0) + 1
-    total_income = sum(x.get("income", 0) for x in fins)
-    total_expense = sum(x.get("expense", 0) for x in fins)
-    summary = generate_summary(month, year, acts, fins)
+# Recap cache keyed on (month, year). Past months only change through our own
+# write endpoints, which invalidate them, so they never expire; the current
+# (and any future) month expires after RECAP_TTL seconds.
+RECAP_TTL = 60
+_recap_cache: Dict[Tuple[int, int], Tuple[Optional[float], RecapResponse]] = {}
+# Bumped on every invalidation so a recap computed across a concurrent write is never stored
+_recap_generation = 0
+
+def _invalidate_recap(d: Optional[date] = None):
+    global _recap_generation
+    _recap_generation += 1
+    # Updates and deletes don't know the month the document used to be in, so they drop everything
+    if d is None:
+        _recap_cache.clear()
+    else:
+        _recap_cache.pop((d.month, d.year), None)
+
+async def _cached_recap(month: int, year: int) -> RecapResponse:
+    key = (month, year)
+    hit = _recap_cache.get(key)
+    if hit and (hit[0] is None or hit[0] > time.monotonic()):
+        return hit[1]
+    generation = _recap_generation
+    recap = await _build_recap(month, year)
+    if generation == _recap_generation:
+        today = date.today()
+        expires_at = None if (year, month) < (today.year, today.month) else time.monotonic() + RECAP_TTL
+        _recap_cache[key] = (expires_at, recap)
+    return recap
+
+async def _build_recap(month: int, year: int) -> RecapResponse:
+    agg = await recap_aggregate(month, year)
+    by_cat = agg["activities_by_category"]
+    total_income = agg["total_income"]
+    total_expense = agg["total_expense"]
+    summary = generate_summary(month, year, by_cat, total_income, total_expense)
     return RecapResponse(
         month=month,
         year=year,
-        total_activities=len(acts),
+        total_activities=sum(by_cat.values()),
         activities_by_category=by_cat,
         total_income=total_income,
         total_expense=total_expense,
@@ -162,18 +248,32 @@ async def monthly_recap(month: int, year: int):
         summary=summary,
     )
 
+@app.get("/recap", response_model=RecapResponse)
+async def monthly_recap(month: int = Query(..., ge=1, le=12), year: int = Query(..., ge=1, le=MAX_YEAR)):
+    return await _cached_recap(month, year)
+
 # Export endpoints (PDF/Excel)
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 import xlsxwriter
 
-@app.get("/export/pdf")
-async def export_pdf(month: int, year: int):
-    recap = await monthly_recap(month, year)
+# Keyed on the rendered lines, so a changed recap simply misses instead of needing invalidation.
+# Helvetica is one of the PDF base-14 fonts, so there is no font registration to hoist out of here.
+@lru_cache(maxsize=32)
+def _render_pdf(lines: Tuple[str, ...]) -> bytes:
     buffer = io.BytesIO()
     c = canvas.Canvas(buffer, pagesize=A4)
     textobject = c.beginText(40, 800)
-    textobject.textLines([
+    textobject.textLines(lines)
+    c.drawText(textobject)
+    c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+@app.get("/export/pdf")
+async def export_pdf(month: int = Query(..., ge=1, le=12), year: int = Query(..., ge=1, le=MAX_YEAR)):
+    recap = await _cached_recap(month, year)
+    pdf = _render_pdf((
         f"Monthly Report {recap.year}-{recap.month:02d}",
         f"Total activities: {recap.total_activities}",
         f"Activities by category: {recap.activities_by_category}",
@@ -183,40 +283,28 @@ async def export_pdf(month: int, year: int):
         "",
         "Summary:",
         recap.summary,
-    ])
-    c.drawText(textobject)
-    c.showPage()
-    c.save()
-    buffer.seek(0)
-    return StreamingResponse(buffer, media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename=report_{year}_{month:02d}.pdf"})
+    ))
+    return Response(pdf, media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename=report_{year}_{month:02d}.pdf"})
 
 @app.get("/export/excel")
-async def export_excel(month: int, year: int):
-    acts = await list_activities(month=month, year=year)
-    fins = await list_finances(month=month, year=year)
+async def export_excel(month: int = Query(..., ge=1, le=12), year: int = Query(..., ge=1, le=MAX_YEAR)):
+    # Rows are written as they come off the cursor, so neither list is ever held in full
+    month_filter = date_range(month, year)
     output = io.BytesIO()
-    import pandas as pd
-    # If pandas not in requirements, we can build with xlsxwriter directly
-    workbook = xlsxwriter.Workbook(output, {"in_memory": True})
+    # constant_memory flushes each row as it is written, so rows must go out in order, one sheet at a time
+    workbook = xlsxwriter.Workbook(output, {"constant_memory": True})
     ws1 = workbook.add_worksheet("Activities")
-    headers_a = ["date","name","category","duration_hours","output","notes"]
-    for i, h in enumerate(headers_a): ws1.write(0, i, h)
-    for r, a in enumerate(acts, start=1):
-        ws1.write(r, 0, str(a.get("date")))
-        ws1.write(r, 1, a.get("name"))
-        ws1.write(r, 2, a.get("category"))
-        ws1.write(r, 3, a.get("duration_hours", 0))
-        ws1.write(r, 4, a.get("output"))
-        ws1.write(r, 5, a.get("notes"))
+    ws1.write_row(0, 0, ["date","name","category","duration_hours","output","notes"])
+    r = 0
+    async for a in iter_documents("activity", month_filter, sort=[("date", 1), ("_id", 1)]):
+        r += 1
+        ws1.write_row(r, 0, [str(a.get("date")), a.get("name"), a.get("category"), a.get("duration_hours", 0), a.get("output"), a.get("notes")])
     ws2 = workbook.add_worksheet("Finance")
-    headers_f = ["date","category","income","expense","notes"]
-    for i, h in enumerate(headers_f): ws2.write(0, i, h)
-    for r, f in enumerate(fins, start=1):
-        ws2.write(r, 0, str(f.get("date")))
-        ws2.write(r, 1, f.get("category"))
-        ws2.write(r, 2, f.get("income", 0))
-        ws2.write(r, 3, f.get("expense", 0))
-        ws2.write(r, 4, f.get("notes"))
+    ws2.write_row(0, 0, ["date","category","income","expense","notes"])
+    r = 0
+    async for f in iter_documents("finance", month_filter, sort=[("date", 1), ("_id", 1)]):
+        r += 1
+        ws2.write_row(r, 0, [str(f.get("date")), f.get("category"), f.get("income", 0), f.get("expense", 0), f.get("notes")])
     workbook.close()
     output.seek(0)
     return StreamingResponse(output, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers={"Content-Disposition": f"attachment; filename=report_{year}_{month:02d}.xlsx"})
@@ -1,11 +1,13 @@
 from pydantic import BaseModel, Field
 from typing import Optional, List
-from datetime import date, datetime
+import datetime as dt
+from datetime import datetime
 
 # Collections: activity, finance, file
 
 class Activity(BaseModel):
-    date: date = Field(...)
+    # dt.date, not date: pydantic 1.x can't resolve a field annotated with its own name
+    date: dt.date = Field(...)
     name: str = Field(..., max_length=200)
     category: str = Field(..., regex=r"^(administration|academics|finance|social|community service|documentation)$")
     duration_hours: float = Field(..., ge=0)
@@ -14,7 +16,7 @@ class Activity(BaseModel):
     file_ids: Optional[List[str]] = None  # references to File documents
 
 class Finance(BaseModel):
-    date: date = Field(...)
+    date: dt.date = Field(...)
     category: str = Field(..., max_length=100)
     income: float = Field(0, ge=0)
     expense: float = Field(0, ge=0)
@@ -40,3 +42,12 @@ class FinanceOut(Finance, DocumentMeta):
 
 class FileOut(File, DocumentMeta):
     pass
+
+# Paginated list responses; pass next_cursor back as ?cursor= to get the following page
+class ActivityPage(BaseModel):
+    items: List[ActivityOut]
+    next_cursor: Optional[str] = None
+
+class FinancePage(BaseModel):
+    items: List[FinanceOut]
+    next_cursor: Optional[str] = None
@@ -0,0 +1,120 @@
+import asyncio
+import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+def _activity(day="2024-05-03"):
+    return {"date": day, "name": "a", "category": "academics", "duration_hours": 1}
+
+
+@pytest.fixture
+def client():
+    # Not used as a context manager, so the startup hook (which pings MongoDB) doesn't run
+    return TestClient(main.app, raise_server_exceptions=False)
+
+
+@pytest.fixture(autouse=True)
+def empty_recap_cache():
+    main._recap_cache.clear()
+    yield
+    main._recap_cache.clear()
+
+
+def test_bulk_rejects_oversized_batches(client):
+    res = client.post("/activities/bulk", json=[_activity()] * (main.MAX_BULK_ITEMS + 1))
+    assert res.status_code == 422
+
+
+def test_bulk_invalidates_recap_even_when_the_insert_fails(client, monkeypatch):
+    async def partially_failing_insert(collection_name, data_list):
+        raise RuntimeError("BulkWriteError after some inserts")
+
+    monkeypatch.setattr(main, "create_documents", partially_failing_insert)
+    main._recap_cache[(5, 2024)] = (None, object())
+    res = client.post("/activities/bulk", json=[_activity()])
+    assert res.status_code == 500
+    assert (5, 2024) not in main._recap_cache
+
+
+@pytest.fixture
+def upload_client(tmp_path, monkeypatch):
+    async def fake_create_document(collection_name, data):
+        now = "2024-05-03T00:00:00+00:00"
+        return {**data, "id": "0" * 24, "created_at": now, "updated_at": now}
+
+    monkeypatch.setattr(main, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "create_document", fake_create_document)
+    # Same middleware in front of the real app, with a limit small enough to test against
+    return TestClient(main.UploadLimitMiddleware(main.app, max_bytes=1000), raise_server_exceptions=False)
+
+
+def test_upload_limit_is_installed():
+    assert any(m.cls is main.UploadLimitMiddleware for m in main.app.user_middleware)
+
+
+def test_upload_with_declared_length_over_limit_is_refused(upload_client, tmp_path):
+    res = upload_client.post("/files", files={"file": ("big.bin", b"x" * 5000)})
+    assert res.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_chunked_upload_over_limit_is_cut_off(upload_client, tmp_path):
+    boundary = "limit-test"
+    head = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"big.bin\"\r\n"
+            "Content-Type: application/octet-stream\r\n\r\n").encode()
+
+    def body():
+        # A generator body is sent with Transfer-Encoding: chunked and no Content-Length
+        yield head
+        for _ in range(10):
+            yield b"x" * 500
+        yield f"\r\n--{boundary}--\r\n".encode()
+
+    res = upload_client.post("/files", content=body(), headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    assert res.request.headers.get("content-length") is None
+    assert res.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_upload_under_limit_is_stored(upload_client, tmp_path):
+    res = upload_client.post("/files", files={"file": ("note.txt", b"hello", "text/plain")})
+    assert res.status_code == 200, res.text
+    body = res.json()
+    assert body["size"] == 5
+    assert body["filename"] == "note.txt"
+    [stored] = tmp_path.iterdir()
+    assert stored.read_bytes() == b"hello"
+
+
+def _recap(month, year):
+    return main.RecapResponse(month=month, year=year, total_activities=0, activities_by_category={},
+                              total_income=0, total_expense=0, net=0, summary="")
+
+
+def test_past_month_recap_is_cached(monkeypatch):
+    calls = []
+
+    async def build(month, year):
+        calls.append((month, year))
+        return _recap(month, year)
+
+    monkeypatch.setattr(main, "_build_recap", build)
+    asyncio.run(main._cached_recap(5, 2020))
+    asyncio.run(main._cached_recap(5, 2020))
+    assert calls == [(5, 2020)]
+
+
+def test_recap_overlapping_an_invalidation_is_not_cached(monkeypatch):
+    async def build_racing_a_write(month, year):
+        recap = _recap(month, year)  # aggregation has read the old data...
+        main._invalidate_recap(datetime.date(year, month, 3))  # ...when a write for that month lands
+        return recap
+
+    monkeypatch.setattr(main, "_build_recap", build_racing_a_write)
+    recap = asyncio.run(main._cached_recap(5, 2020))
+    assert recap.month == 5
+    assert (5, 2020) not in main._recap_cache
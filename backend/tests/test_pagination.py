@@ -0,0 +1,143 @@
+import asyncio
+import re
+from datetime import date, datetime, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+from bson import ObjectId
+
+import database
+import main
+
+
+def _matches(doc, query):
+    for key, cond in query.items():
+        if key == "$and":
+            if not all(_matches(doc, q) for q in cond):
+                return False
+        elif key == "$or":
+            if not any(_matches(doc, q) for q in cond):
+                return False
+        elif isinstance(cond, dict):
+            ops = {
+                "$gt": lambda a, b: type(a) is type(b) and a > b,
+                "$gte": lambda a, b: type(a) is type(b) and a >= b,
+                "$lt": lambda a, b: type(a) is type(b) and a < b,
+                "$type": lambda a, b: b == "date" and isinstance(a, datetime),
+            }
+            if not all(ops[op](doc[key], v) for op, v in cond.items()):
+                return False
+        elif doc[key] != cond:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def batch_size(self, n):
+        return self
+
+    def sort(self, spec):
+        for key, direction in reversed(spec):
+            self.docs.sort(key=lambda d: d[key], reverse=direction < 0)
+        return self
+
+    def limit(self, n):
+        self.docs = self.docs[:n]
+        return self
+
+    async def to_list(self, length):
+        return self.docs[:length]
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query):
+        return FakeCursor([dict(d) for d in self.docs if _matches(d, query)])
+
+
+@pytest.fixture
+def activities(monkeypatch):
+    # Several documents share a day; some carry a time of day, as migrated legacy strings do.
+    # Aware UTC, which is what the tz_aware Motor client hands back.
+    utc = timezone.utc
+    stamps = [
+        datetime(2024, 5, 1, tzinfo=utc),
+        datetime(2024, 5, 1, 9, 30, tzinfo=utc),
+        datetime(2024, 5, 1, 9, 30, tzinfo=utc),
+        datetime(2024, 5, 1, 18, 0, tzinfo=utc),
+        datetime(2024, 5, 2, tzinfo=utc),
+        datetime(2024, 5, 3, 12, 0, 0, 250000, tzinfo=utc),
+        datetime(2024, 5, 3, 12, 0, 0, 250000, tzinfo=utc),
+    ]
+    docs = [{"_id": ObjectId(), "date": d, "name": f"a{i}"} for i, d in enumerate(stamps)]
+    monkeypatch.setitem(database.collections, "activity", FakeCollection(docs))
+    return docs
+
+
+def _walk(page_size, filter_dict=None):
+    pages, cursor = [], None
+    while True:
+        page = asyncio.run(database.get_documents_page("activity", filter_dict, page_size=page_size, cursor=cursor))
+        pages.append(page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return pages
+        assert len(pages) <= 10, "cursor did not advance"
+
+
+@pytest.mark.parametrize("page_size", [1, 2, 3, 7, 10])
+def test_pages_cover_every_document_once_in_order(activities, page_size):
+    pages = _walk(page_size)
+    seen = [item["name"] for page in pages for item in page]
+    expected = [d["name"] for d in sorted(activities, key=lambda d: (d["date"], d["_id"]))]
+    assert seen == expected
+    assert all(len(page) == page_size for page in pages[:-1])
+    assert isinstance(pages[0][0]["date"], date)
+
+
+def test_cursor_is_url_safe(activities):
+    page = asyncio.run(database.get_documents_page("activity", page_size=1))
+    assert re.fullmatch(r"-?\d+_[0-9a-f]{24}", page["next_cursor"])
+
+
+def test_list_endpoint_accepts_cursor_unquoted(activities):
+    # What the README tells clients to do: paste next_cursor straight into ?cursor=
+    client = TestClient(main.app)
+    seen, cursor = [], None
+    while True:
+        url = "/activities?page_size=2" + (f"&cursor={cursor}" if cursor else "")
+        res = client.get(url)
+        assert res.status_code == 200, res.text
+        body = res.json()
+        seen += [item["name"] for item in body["items"]]
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == [d["name"] for d in sorted(activities, key=lambda d: (d["date"], d["_id"]))]
+    assert body["items"][-1]["date"] == "2024-05-03"
+
+
+def test_last_full_page_has_no_next_cursor(activities):
+    page = asyncio.run(database.get_documents_page("activity", page_size=len(activities)))
+    assert len(page["items"]) == len(activities)
+    assert page["next_cursor"] is None
+
+
+@pytest.mark.parametrize("cursor", ["garbage", "2024-05-01_nope", "not-a-date_" + str(ObjectId())])
+def test_malformed_cursor_raises_value_error(activities, cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        asyncio.run(database.get_documents_page("activity", cursor=cursor))
+
+
+def test_unconverted_legacy_dates_are_left_out(activities):
+    # init_db() leaves strings $convert can't parse in place; BSON would sort them first
+    activities.insert(0, {"_id": ObjectId(), "date": "sometime in May", "name": "legacy"})
+    pages = _walk(1, database.date_range())
+    assert "legacy" not in [item["name"] for page in pages for item in page]
+    assert sum(len(page) for page in pages) == len(activities) - 1
+